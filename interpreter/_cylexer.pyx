@@ -0,0 +1,204 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# _cylexer.pyx
+"""
+compiled fast path of Lexer.parse, used by lexer.py when it has been built
+with `python setup.py build_ext --inplace`
+
+it scans the UTF-8 bytes of the source and gives the same tokens and errors
+as the pure Python Lexer
+"""
+import sys
+
+
+# kind of token an ASCII char starts, the same classes as lexer.py
+cdef enum:
+    IDENTIFIER = 0
+    NEWLINE = 1
+    PARENTHESIS_L = 2
+    PARENTHESIS_R = 3
+    COLON = 4
+    DIGIT = 5
+    QUOTE = 6
+    OPERATOR = 7
+
+cdef unsigned char CHAR_CLASS[128]
+# whether an ASCII char can be part of an identifier
+cdef unsigned char IDENTIFIER_CHAR[128]
+cdef unsigned char HEX_DIGIT[128]
+
+cdef int _code
+for _code in range(128):
+    CHAR_CLASS[_code] = IDENTIFIER
+    IDENTIFIER_CHAR[_code] = 1
+    HEX_DIGIT[_code] = 0
+CHAR_CLASS[ord('\n')] = NEWLINE
+for _char in '([{':
+    CHAR_CLASS[ord(_char)] = PARENTHESIS_L
+for _char in ')]}':
+    CHAR_CLASS[ord(_char)] = PARENTHESIS_R
+CHAR_CLASS[ord(':')] = COLON
+for _char in '0123456789':
+    CHAR_CLASS[ord(_char)] = DIGIT
+for _char in '\'"':
+    CHAR_CLASS[ord(_char)] = QUOTE
+for _char in '+-*/%=':
+    CHAR_CLASS[ord(_char)] = OPERATOR
+for _char in ' :()[]{}"\'\n+-*/%=':
+    IDENTIFIER_CHAR[ord(_char)] = 0
+for _char in '0123456789abcdefABCDEF':
+    HEX_DIGIT[ord(_char)] = 1
+
+# decoded char of the single char escapes, indexed by the char after the
+# backslash, None for the others
+cdef list ESCAPES = [None] * 128
+for _char, _decoded in (('n', '\n'), ('t', '\t'), ('r', '\r'), ('b', '\b'), ('f', '\f'),
+                        ('\\', '\\'), ('"', '"'), ("'", "'")):
+    ESCAPES[ord(_char)] = _decoded
+
+
+cdef class CyLexer:
+    """
+    takes the Token class, the TokenType enum and the error class of
+    lexer.py so the tokens and errors are the ones it makes
+    """
+    cdef object token
+    cdef object error_type
+    cdef object literal
+    cdef object identifier
+    cdef object newline
+    cdef object parenthesis_l
+    cdef object parenthesis_r
+    cdef object assignment
+
+    def __init__(self, token, token_type, error_type):
+        self.token = token
+        self.error_type = error_type
+        self.literal = token_type.LITERAL
+        self.identifier = token_type.IDENTIFIER
+        self.newline = token_type.NEWLINE
+        self.parenthesis_l = token_type.PARENTHESIS_L
+        self.parenthesis_r = token_type.PARENTHESIS_R
+        self.assignment = token_type.ASSIGNMENT
+
+    cdef error(self, message):
+        raise self.error_type(f'Token error: {message}')
+
+    cpdef list parse(self, bytes source):
+        cdef const unsigned char* s = source
+        cdef const char* chars = source
+        cdef Py_ssize_t n = len(source)
+        cdef Py_ssize_t pos = 0
+        cdef Py_ssize_t start
+        cdef unsigned char c
+        cdef unsigned char kind
+        cdef list tokens = []
+        token = self.token
+
+        while True:
+            while pos < n and s[pos] == c' ':
+                pos += 1
+            if pos >= n:
+                return tokens
+            c = s[pos]
+            kind = CHAR_CLASS[c] if c < 128 else IDENTIFIER
+
+            if kind == IDENTIFIER:
+                start = pos
+                while pos < n and (s[pos] >= 128 or IDENTIFIER_CHAR[s[pos]]):
+                    pos += 1
+                tokens.append(token(self.identifier,
+                                    sys.intern(chars[start:pos].decode('utf-8', 'surrogatepass'))))
+            elif kind == DIGIT:
+                tokens.append(token(self.literal, self._number(s, chars, n, &pos)))
+            elif kind == OPERATOR:
+                pos += 1
+                tokens.append(token(self.identifier, chr(c)))
+            elif kind == NEWLINE:
+                pos += 1
+                tokens.append(token(self.newline, '\n'))
+            elif kind == PARENTHESIS_L:
+                pos += 1
+                tokens.append(token(self.parenthesis_l, chr(c)))
+            elif kind == PARENTHESIS_R:
+                pos += 1
+                tokens.append(token(self.parenthesis_r, chr(c)))
+            elif kind == COLON:
+                if pos + 1 < n and s[pos + 1] == c'=':
+                    pos += 2
+                    tokens.append(token(self.assignment, ':='))
+                else:
+                    pos += 1
+                    tokens.append(token(self.identifier, ':'))
+            else:
+                tokens.append(token(self.literal, self._string(s, chars, n, &pos)))
+
+    cdef object _number(self, const unsigned char* s, const char* chars,
+                        Py_ssize_t n, Py_ssize_t* ppos):
+        cdef Py_ssize_t start = ppos[0]
+        cdef Py_ssize_t pos = start
+        cdef Py_ssize_t i
+        cdef long long value = 0
+        while pos < n and c'0' <= s[pos] <= c'9':
+            pos += 1
+        if pos < n and s[pos] == c'.':
+            pos += 1
+            while pos < n and c'0' <= s[pos] <= c'9':
+                pos += 1
+            ppos[0] = pos
+            return float(chars[start:pos])
+        ppos[0] = pos
+        # more than 18 digits may not fit in a long long
+        if pos - start > 18:
+            return int(chars[start:pos])
+        for i in range(start, pos):
+            value = value * 10 + (s[i] - c'0')
+        return value
+
+    cdef str _string(self, const unsigned char* s, const char* chars,
+                     Py_ssize_t n, Py_ssize_t* ppos):
+        cdef unsigned char quot = s[ppos[0]]
+        cdef Py_ssize_t pos = ppos[0] + 1
+        cdef Py_ssize_t start
+        cdef Py_ssize_t count
+        cdef Py_ssize_t width
+        cdef unsigned char c
+        cdef list parts = []
+
+        while True:
+            # the part up to the closing quote, a line break or an escape
+            start = pos
+            while pos < n and s[pos] != quot and s[pos] != c'\\' and s[pos] != c'\n':
+                pos += 1
+            parts.append(chars[start:pos].decode('utf-8', 'surrogatepass'))
+            if pos >= n or s[pos] == quot:
+                break
+            if s[pos] == c'\n':
+                self.error("Unexpected End of Line")
+
+            pos += 1  # the backslash
+            if pos >= n:
+                break
+            c = s[pos]
+            if c < 128 and ESCAPES[c] is not None:
+                parts.append(ESCAPES[c])
+                pos += 1
+            elif c == c'x' or c == c'u' or c == c'U':
+                count = 2 if c == c'x' else 4 if c == c'u' else 8
+                pos += 1
+                start = pos
+                while pos < n and pos - start < count and s[pos] < 128 and HEX_DIGIT[s[pos]]:
+                    pos += 1
+                if pos - start != count:
+                    self.error(f"Expected {count} hex digits after escape sequence")
+                parts.append(chr(int(chars[start:pos], 16)))
+            else:
+                # unknown escape, kept with its backslash, the char after it
+                # may take several UTF-8 bytes
+                width = 1 if c < 0xC0 else 2 if c < 0xE0 else 3 if c < 0xF0 else 4
+                parts.append('\\' + chars[pos:pos + width].decode('utf-8', 'surrogatepass'))
+                pos += width
+
+        if pos >= n:
+            self.error('Unexpected EOF')
+        ppos[0] = pos + 1
+        return ''.join(parts)
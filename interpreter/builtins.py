@@ -3,6 +3,11 @@ from types import MappingProxyType
 from functools import wraps
 
 from interpreter.parser import Quot
+from interpreter.opcodes import ADD, SUB, MUL, DIV, MOD, DUP, DROP, SWAP, ROT, CALL_QUOT
+
+
+class RunTimeError(Exception):
+    pass
 
 
 def stack_args(num_args):
@@ -11,10 +16,10 @@ def stack_args(num_args):
     def decorator(func):
         @wraps(func)
         def wrapper(runtime):
-            stack = runtime.stack
-            if len(stack) < num_args:
-                from interpreter.evaluation import RunTimeError
-                raise RunTimeError(f'Expected {num_args} items on stack but got {len(stack)}')
+            # only the items above the innermost list being built count
+            depth = len(runtime.stack) - runtime.base
+            if depth < num_args:
+                raise RunTimeError(f'Expected {num_args} items on stack but got {depth}')
             return func(runtime)
 
         return wrapper
@@ -67,23 +72,25 @@ def dup(runtime):
 
 
 @stack_args(1)
-def run_quot(runtime):
+def pop_quot(runtime):
     stack = runtime.stack
     quot = stack.pop()
     if not isinstance(quot, Quot):
         raise TypeError(f'Expected quotation but got {type(quot)}')
-    expr = quot.expr
-    runtime.visit_expr(expr)
+    return quot.expr
+
+
+def run_quot(runtime):
+    runtime.visit_expr(pop_quot(runtime))
 
 
 @stack_args(0)
 def print_stack(runtime):
-    stack = runtime.stack
-    print(stack)
+    print(runtime.stack[runtime.base:])
 
 @stack_args(0)
 def clear_stack(runtime):
-    runtime.stack = []
+    del runtime.stack[runtime.base:]
 
 @stack_args(1)
 def print_top(runtime):
@@ -133,3 +140,18 @@ BUILTIN_SCOPE = MappingProxyType({
     'swap': swap_two,
     'rot': rot_three,
 })
+
+
+# builtins the compiler replaces with a dedicated opcode
+INLINE_OPCODES = MappingProxyType({
+    stack_plus: ADD,
+    stack_minus: SUB,
+    stack_multiply: MUL,
+    stack_divide: DIV,
+    stack_mod: MOD,
+    dup: DUP,
+    drop_top: DROP,
+    swap_two: SWAP,
+    rot_three: ROT,
+    run_quot: CALL_QUOT,
+})
@@ -2,78 +2,288 @@
 import time
 
 from interpreter.parser import ASTNode, Program, Decl, Expr, Literal, Identifier, Quot, List
-from interpreter.builtins import BUILTIN_SCOPE
+from interpreter.builtins import BUILTIN_SCOPE, INLINE_OPCODES, RunTimeError, pop_quot
+from interpreter.opcodes import CALL_USER, TAILCALL, LAST_CONTROL, PUSH_LITERAL, CALL_BUILTIN, UNKNOWN
 
 
-class RunTimeError(Exception):
-    pass
+def _op_push_literal(runtime, value):
+    runtime.stack.append(value)
+
+
+def _op_push_quot(runtime, quot):
+    runtime.stack.append(quot)
+
+
+def _op_begin_list(runtime, _):
+    runtime.base = len(runtime.stack)
+    runtime.savepoints.append(runtime.base)
+
+
+def _op_end_list(runtime, _):
+    stack = runtime.stack
+    savepoints = runtime.savepoints
+    start = savepoints.pop()
+    items = stack[start:]
+    del stack[start:]
+    stack.append(items)
+    runtime.base = savepoints[-1] if savepoints else 0
+
+
+def _op_call_builtin(runtime, func):
+    func(runtime)
+
+
+def _op_unknown(runtime, name):
+    raise RunTimeError(f"Unknown identifier {name}")
+
+
+def _op_check_depth(runtime, arg):
+    need, block = arg
+    if len(runtime.stack) - runtime.base < need:
+        # replay the block through the checked builtins, so the error is
+        # raised by the same atom and leaves the same stack as unhoisted
+        for op, arg in block:
+            DISPATCH[op](runtime, arg)
+
+
+# the operands are popped before the operation, so a failing one leaves
+# the stack as the builtins it replaces do
+def _op_add(runtime, _):
+    stack = runtime.stack
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(a + b)
+
+
+def _op_sub(runtime, _):
+    stack = runtime.stack
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(a - b)
+
+
+def _op_mul(runtime, _):
+    stack = runtime.stack
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(a * b)
+
+
+def _op_div(runtime, _):
+    stack = runtime.stack
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(a / b)
+
+
+def _op_mod(runtime, _):
+    stack = runtime.stack
+    b = stack.pop()
+    a = stack.pop()
+    stack.append(a % b)
+
+
+def _op_dup(runtime, _):
+    stack = runtime.stack
+    stack.append(stack[-1])
+
+
+def _op_drop(runtime, _):
+    del runtime.stack[-1]
+
+
+def _op_swap(runtime, _):
+    stack = runtime.stack
+    stack[-2], stack[-1] = stack[-1], stack[-2]
+
+
+def _op_rot(runtime, _):
+    stack = runtime.stack
+    stack.append(stack.pop(-3))
+
+
+# indexed by opcode, see interpreter/opcodes.py
+# control flow opcodes are handled by RunTime.execute itself
+DISPATCH = (
+    None,
+    None,
+    None,
+    _op_push_literal,
+    _op_push_quot,
+    _op_begin_list,
+    _op_end_list,
+    _op_call_builtin,
+    _op_unknown,
+    _op_check_depth,
+    _op_add,
+    _op_sub,
+    _op_mul,
+    _op_div,
+    _op_mod,
+    _op_dup,
+    _op_drop,
+    _op_swap,
+    _op_rot,
+)
+
 
 class RunTime:
     """
     runtime for stack-based language interpreter
     """
+    # calls nest on an explicit call stack rather than the Python one, so
+    # the limit can be far above the interpreter's recursion limit
+    MAX_CALL_DEPTH = 10_000
+
     def __init__(self, parent: 'RunTime' = None):
         self.stack = []
-        self.scope = {}
+        # the words of the parent chain are copied in, so a lookup is one
+        # dict probe however deep the runtime is nested
+        self.scope = dict(parent.scope) if parent is not None else {}
         self.builtin_scope = BUILTIN_SCOPE
         self.parent = parent
-        self.recursion_depth = 0
-        self.max_recursion_depth = 100
+        # items of the lists being built sit on the stack above the
+        # savepoints, base is the innermost one
+        self.savepoints = []
+        self.base = 0
+        # bumped to invalidate compiled exprs when a declaration rebinds a
+        # name that compiled code has already resolved
+        self.scope_version = 0
+        self.resolved_names = set()
 
     def evaluate(self, node: ASTNode):
-        node.accept(self)
+        if type(node) is Program:
+            self.visit_program(node)
+        else:
+            node.accept(self)
+        return self.stack
+
+    def jit_evaluate(self, node: ASTNode):
+        """
+        Same as evaluate, but the exprs of node that only do numeric stack
+        work run through the Numba backend when numba is installed
+        """
+        # imported here, numpy and numba are slow to import and only
+        # needed with --jit
+        from interpreter import jit
+        statements = node.statements if type(node) is Program else [node]
+        for stmt in statements:
+            if not (type(stmt) is Expr and jit.run(self, stmt)):
+                stmt.accept(self)
         return self.stack
 
     def visit_program(self, program: Program):
+        # statements are dispatched on their type here instead of through
+        # accept, exprs are by far the most common
         for stmt in program.statements:
-            stmt.accept(self)
+            kind = type(stmt)
+            if kind is Expr:
+                self.execute(self.compiled(stmt))
+            elif kind is Decl:
+                self.visit_decl(stmt)
+            else:
+                stmt.accept(self)
 
     def visit_decl(self, decl: Decl):
         ident_name = decl.word.name
         expr = decl.expr
         self.scope[ident_name] = expr
+        # code compiled so far only depends on the names it looked up
+        if ident_name in self.resolved_names:
+            self.scope_version += 1
+            self.resolved_names.clear()
+        # compile the body now so calls to the word run cached code
+        self.compiled(expr)
 
     def visit_expr(self, expr: Expr):
-        for atom in expr.atoms:
-            atom.accept(self)
+        self.execute(self.compiled(expr))
 
     def visit_literal(self, literal: Literal):
         self.stack.append(literal.content)
 
     def visit_identifier(self, identifier: Identifier):
-        if self.recursion_depth >= self.max_recursion_depth:
-            self.recursion_depth = 0
-            raise RunTimeError("Maximum recursion depth reached")
-
-        self.recursion_depth += 1
-        name = identifier.name
-        if name in self.scope:
-            expr = self.scope[name]
-            expr.accept(self)
-            self.recursion_depth -= 1
-        elif name in self.builtin_scope:
-            func = self.builtin_scope[name]
-            func(self)
-            self.recursion_depth -= 1
-        else:
-            cur_runtime = self
-            while cur_runtime.parent:
-                cur_runtime = cur_runtime.parent
-                if name in cur_runtime.scope:
-                    expr = cur_runtime.scope[name]
-                    expr.accept(self)
-                    self.recursion_depth -= 1
-                    return
-            raise RunTimeError(f"Unknown identifier {name}")
+        self.execute([self.resolve(identifier.name)])
 
     def visit_quot(self, quot: Quot):
         self.stack.append(quot)
 
     def visit_list(self, lst: List):
-        sub_runtime = RunTime(parent=self)
-        sub_runtime.evaluate(lst.items)
-        result = sub_runtime.stack
-        self.stack.append(result)
+        expr = Expr()
+        expr.add_atom(lst)
+        self.visit_expr(expr)
+
+    def resolve(self, name):
+        """Look a name up in the scope, returns an (opcode, arg) pair"""
+        self.resolved_names.add(name)
+        if name in self.scope:
+            # the callee is compiled when it is first called, not here, so
+            # compiling a long chain of words doesn't recurse through it
+            return CALL_USER, self.scope[name]
+        if name in self.builtin_scope:
+            func = self.builtin_scope[name]
+            return INLINE_OPCODES.get(func, CALL_BUILTIN), func
+        return UNKNOWN, name
+
+    def compiled(self, expr: Expr):
+        """Return the code of expr, compiling it if the cached one is stale"""
+        if expr.code_owner is not self or expr.code_version != self.scope_version:
+            return expr.compile(self)
+        return expr.code
+
+    def execute(self, code):
+        """
+        Run compiled code, calls to user words and quotations push a frame
+        on an explicit call stack instead of recursing in Python, calls in
+        tail position reuse the current frame
+        """
+        # opcodes as locals, the loop is the hot path
+        dispatch, call_user, tailcall, last_control, push_literal = (
+            DISPATCH, CALL_USER, TAILCALL, LAST_CONTROL, PUSH_LITERAL)
+        # a frame is the iterator over the code of the caller, so it
+        # resumes right after the call once the callee is exhausted. It is
+        # saved with the depth of the caller, a tail call reuses the frame
+        # but still counts as one level, so runaway recursion in tail
+        # position hits the limit instead of looping forever
+        call_stack = []
+        depth = 0
+        max_depth = self.MAX_CALL_DEPTH
+        savepoints = len(self.savepoints)
+        frame = iter(code)
+        try:
+            while True:
+                for op, arg in frame:
+                    # literals are the most common atom, push them without
+                    # calling their handler
+                    if op == push_literal:
+                        self.stack.append(arg)
+                        continue
+                    if op > last_control:
+                        dispatch[op](self, arg)
+                        continue
+                    if op == tailcall:
+                        if depth >= max_depth:
+                            raise RunTimeError("Maximum recursion depth reached")
+                        depth += 1
+                        frame = iter(self.compiled(arg))
+                        break
+                    code = self.compiled(arg if op == call_user else pop_quot(self))
+                    if depth >= max_depth:
+                        raise RunTimeError("Maximum recursion depth reached")
+                    call_stack.append((frame, depth))
+                    depth += 1
+                    frame = iter(code)
+                    break
+                else:
+                    if not call_stack:
+                        return
+                    frame, depth = call_stack.pop()
+        except BaseException:
+            # drop the items of the lists that were being built
+            if len(self.savepoints) > savepoints:
+                del self.stack[self.savepoints[savepoints]:]
+                del self.savepoints[savepoints:]
+                self.base = self.savepoints[-1] if self.savepoints else 0
+            raise
 
     def generic_visit(self, node: ASTNode):
         pass
@@ -87,6 +297,7 @@ def repl() -> None:
     lexer = Lexer()
     parser = Parser()
     runtime = RunTime()
+    evaluate = runtime.jit_evaluate if '--jit' in sys.argv[1:] else runtime.evaluate
 
     print("Mini-lang 0.1.0  (type 'exit' or Ctrl-D to quit)")
     while True:
@@ -102,7 +313,7 @@ def repl() -> None:
         try:
             tokens = lexer.parse(source)
             ast    = parser.parse(tokens)
-            runtime.evaluate(ast)
+            evaluate(ast)
         except Exception as exc:
             print(f"{exc.__class__.__name__}: {exc}", file=sys.stderr)
             time.sleep(0.5)
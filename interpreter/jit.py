@@ -0,0 +1,319 @@
+# jit.py
+"""
+optional Numba backend for numeric exprs
+
+an expr whose code only pushes numbers, does arithmetic, shuffles the stack
+and calls user words is lowered to two int64 arrays (opcodes and args) and
+run by an njit'd loop over a NumPy operand stack. Everything else, and any
+run that fails, goes through the interpreter, so the results and errors
+are always the ones RunTime.evaluate gives
+"""
+from interpreter.opcodes import (CALL_USER, TAILCALL, PUSH_LITERAL, CHECK_DEPTH,
+                                 ADD, SUB, MUL, DIV, MOD, DUP, DROP, SWAP, ROT)
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
+
+RET = -1            # end of a word body in the lowered code
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+# results at least this large may not fit in int64, the check is done in
+# float arithmetic because LLVM folds checks on a wrapped int result away
+INT64_LIMIT = 9.2e18
+
+# free stack slots on top of the stack the expr starts with
+STACK_SLACK = 1024
+
+# status returned by the run loops, anything but OK means "use the interpreter"
+OK = 0
+UNDERFLOW = 1
+CALL_DEPTH = 2
+OVERFLOW = 3
+STACK_FULL = 4
+
+# lowered code by (id of the compiled code, types on the stack)
+LOWERED_CACHE_SIZE = 256
+_lowered = {}
+# return stack buffer shared by every run
+_call_stack = None
+
+NUMERIC_OPS = frozenset((PUSH_LITERAL, CHECK_DEPTH, ADD, SUB, MUL, DIV, MOD,
+                         DUP, DROP, SWAP, ROT, CALL_USER, TAILCALL))
+
+
+def lower(runtime, expr):
+    """
+    Lower expr and every word it calls into (is_int, ops, args, consts) with
+    NumPy arrays, or return None if the code does anything but numeric
+    stack work. The result is cached until the expr is recompiled or the
+    types on the stack change
+    """
+    code = runtime.compiled(expr)
+    key = (id(code), frozenset(type(value) for value in runtime.stack))
+    cached = _lowered.get(key)
+    # the code list is kept in the entry, so its id can't be reused while
+    # the entry exists
+    if cached is not None and cached[0] is code:
+        return cached[1]
+    lowered = _lower(runtime, code, key[1])
+    if len(_lowered) >= LOWERED_CACHE_SIZE:
+        _lowered.clear()
+    _lowered[key] = (code, lowered)
+    return lowered
+
+
+def _lower(runtime, code, stack_types):
+    # the bodies of the called words are collected with a worklist, each
+    # compiled on the way like a call in RunTime.execute would
+    bodies = [code]
+    seen = {id(code)}
+    literals = []
+    for body in bodies:
+        for op, arg in body:
+            if op not in NUMERIC_OPS:
+                return None
+            if op == PUSH_LITERAL:
+                literals.append(arg)
+            elif op == CALL_USER or op == TAILCALL:
+                callee = runtime.compiled(arg)
+                if id(callee) not in seen:
+                    seen.add(id(callee))
+                    bodies.append(callee)
+
+    types = {type(value) for value in literals} | stack_types
+    if types <= {int}:
+        is_int = True
+    elif types == {float}:
+        is_int = False
+    else:
+        return None
+
+    ops = []
+    args = []
+    consts = []
+    address = {}
+    calls = []
+    for body in bodies:
+        address[id(body)] = len(ops)
+        for op, arg in body:
+            if op == PUSH_LITERAL:
+                if is_int:
+                    if not INT64_MIN <= arg <= INT64_MAX:
+                        return None
+                else:
+                    consts.append(arg)
+                    arg = len(consts) - 1
+            elif op == CHECK_DEPTH:
+                arg = arg[0]
+            elif op == CALL_USER or op == TAILCALL:
+                calls.append((len(ops), runtime.compiled(arg)))
+                arg = 0
+            elif op == DIV and is_int:
+                return None
+            else:
+                arg = 0
+            ops.append(op)
+            args.append(arg)
+        ops.append(RET)
+        args.append(0)
+    for index, callee in calls:
+        args[index] = address[id(callee)]
+    return (is_int, np.array(ops, dtype=np.int64), np.array(args, dtype=np.int64),
+            np.array(consts, dtype=np.float64))
+
+
+def run(runtime, expr):
+    """
+    Run expr through the Numba backend, returns False without touching the
+    runtime if it has to be evaluated by the interpreter instead
+    """
+    global _call_stack
+    if njit is None:
+        return False
+    lowered = lower(runtime, expr)
+    if lowered is None:
+        return False
+    is_int, code, code_args, consts = lowered
+    for value in runtime.stack:
+        if is_int and not INT64_MIN <= value <= INT64_MAX:
+            return False
+
+    depth = len(runtime.stack)
+    stack = np.empty(depth + STACK_SLACK, dtype=np.int64 if is_int else np.float64)
+    stack[:depth] = runtime.stack
+    max_depth = runtime.MAX_CALL_DEPTH
+    if _call_stack is None or len(_call_stack) != 2 * max_depth:
+        _call_stack = np.empty(2 * max_depth, dtype=np.int64)
+    try:
+        if is_int:
+            status, sp = _run_int(code, code_args, stack, depth, _call_stack, max_depth)
+        else:
+            status, sp = _run_real(code, code_args, consts, stack, depth, _call_stack,
+                                   max_depth)
+    except ZeroDivisionError:
+        return False
+    if status != OK:
+        return False
+    runtime.stack[:] = stack[:sp].tolist()
+    return True
+
+
+def _run_int(code, args, stack, sp, call_stack, max_depth):
+    # call_stack holds (return ip, depth of the caller) pairs, a tail call
+    # counts as a level like in RunTime.execute
+    ip = 0
+    rp = 0
+    depth = 0
+    while True:
+        op = code[ip]
+        arg = args[ip]
+        ip += 1
+        if op == PUSH_LITERAL:
+            if sp == len(stack):
+                return STACK_FULL, sp
+            stack[sp] = arg
+            sp += 1
+        elif op == CHECK_DEPTH:
+            if sp < arg:
+                return UNDERFLOW, sp
+        elif op == ADD:
+            a = stack[sp - 2]
+            b = stack[sp - 1]
+            if abs(float(a) + float(b)) >= INT64_LIMIT:
+                return OVERFLOW, sp
+            stack[sp - 2] = a + b
+            sp -= 1
+        elif op == SUB:
+            a = stack[sp - 2]
+            b = stack[sp - 1]
+            if abs(float(a) - float(b)) >= INT64_LIMIT:
+                return OVERFLOW, sp
+            stack[sp - 2] = a - b
+            sp -= 1
+        elif op == MUL:
+            a = stack[sp - 2]
+            b = stack[sp - 1]
+            if abs(float(a) * float(b)) >= INT64_LIMIT:
+                return OVERFLOW, sp
+            stack[sp - 2] = a * b
+            sp -= 1
+        elif op == MOD:
+            a = stack[sp - 2]
+            b = stack[sp - 1]
+            # INT64_MIN % -1 traps in machine code
+            stack[sp - 2] = 0 if b == -1 else a % b
+            sp -= 1
+        elif op == DUP:
+            if sp == len(stack):
+                return STACK_FULL, sp
+            stack[sp] = stack[sp - 1]
+            sp += 1
+        elif op == DROP:
+            sp -= 1
+        elif op == SWAP:
+            a = stack[sp - 2]
+            stack[sp - 2] = stack[sp - 1]
+            stack[sp - 1] = a
+        elif op == ROT:
+            a = stack[sp - 3]
+            stack[sp - 3] = stack[sp - 2]
+            stack[sp - 2] = stack[sp - 1]
+            stack[sp - 1] = a
+        elif op == CALL_USER:
+            if depth == max_depth:
+                return CALL_DEPTH, sp
+            call_stack[rp] = ip
+            call_stack[rp + 1] = depth
+            rp += 2
+            depth += 1
+            ip = arg
+        elif op == TAILCALL:
+            if depth == max_depth:
+                return CALL_DEPTH, sp
+            depth += 1
+            ip = arg
+        else:  # RET
+            if rp == 0:
+                return OK, sp
+            rp -= 2
+            ip = call_stack[rp]
+            depth = call_stack[rp + 1]
+
+
+def _run_real(code, args, consts, stack, sp, call_stack, max_depth):
+    ip = 0
+    rp = 0
+    depth = 0
+    while True:
+        op = code[ip]
+        arg = args[ip]
+        ip += 1
+        if op == PUSH_LITERAL:
+            if sp == len(stack):
+                return STACK_FULL, sp
+            stack[sp] = consts[arg]
+            sp += 1
+        elif op == CHECK_DEPTH:
+            if sp < arg:
+                return UNDERFLOW, sp
+        elif op == ADD:
+            stack[sp - 2] = stack[sp - 2] + stack[sp - 1]
+            sp -= 1
+        elif op == SUB:
+            stack[sp - 2] = stack[sp - 2] - stack[sp - 1]
+            sp -= 1
+        elif op == MUL:
+            stack[sp - 2] = stack[sp - 2] * stack[sp - 1]
+            sp -= 1
+        elif op == DIV:
+            stack[sp - 2] = stack[sp - 2] / stack[sp - 1]
+            sp -= 1
+        elif op == MOD:
+            stack[sp - 2] = stack[sp - 2] % stack[sp - 1]
+            sp -= 1
+        elif op == DUP:
+            if sp == len(stack):
+                return STACK_FULL, sp
+            stack[sp] = stack[sp - 1]
+            sp += 1
+        elif op == DROP:
+            sp -= 1
+        elif op == SWAP:
+            a = stack[sp - 2]
+            stack[sp - 2] = stack[sp - 1]
+            stack[sp - 1] = a
+        elif op == ROT:
+            a = stack[sp - 3]
+            stack[sp - 3] = stack[sp - 2]
+            stack[sp - 2] = stack[sp - 1]
+            stack[sp - 1] = a
+        elif op == CALL_USER:
+            if depth == max_depth:
+                return CALL_DEPTH, sp
+            call_stack[rp] = ip
+            call_stack[rp + 1] = depth
+            rp += 2
+            depth += 1
+            ip = arg
+        elif op == TAILCALL:
+            if depth == max_depth:
+                return CALL_DEPTH, sp
+            depth += 1
+            ip = arg
+        else:  # RET
+            if rp == 0:
+                return OK, sp
+            rp -= 2
+            ip = call_stack[rp]
+            depth = call_stack[rp + 1]
+
+
+if njit is not None:
+    _run_int = njit(cache=True)(_run_int)
+    _run_real = njit(cache=True)(_run_real)
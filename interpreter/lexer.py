@@ -1,10 +1,62 @@
 # lexer.py
+import re
+import sys
 from enum import Enum
 
+try:
+    from interpreter._cylexer import CyLexer
+except ImportError:
+    CyLexer = None
+
 
 NON_IDENTIFIER_SYMBOLS = frozenset(" :()[]{}\"\'\n")
 OPERATOR_SYMBOLS = frozenset("+-*/%=")
 
+# each token is scanned by one regex match instead of a loop over its chars
+_SPACES_RE = re.compile(r' *')
+_NUMBER_RE = re.compile(r'[0-9]+(\.[0-9]*)?')
+_IDENTIFIER_RE = re.compile(
+    '[^' + re.escape(''.join(sorted(NON_IDENTIFIER_SYMBOLS | OPERATOR_SYMBOLS))) + ']+')
+_HEX_DIGITS_RE = re.compile(r'[0-9A-Fa-f]*')
+# the part of a string up to its closing quote, a line break or an escape
+_STRING_RUN_RE = {
+    '"': re.compile(r'[^"\\\n]*'),
+    "'": re.compile(r"[^'\\\n]*"),
+}
+
+# decoded char of the single char escapes, indexed by ord() of the char after
+# the backslash, None for the others
+_ESCAPE_TBL = [None] * 128
+for _char, _decoded in (('n', '\n'), ('t', '\t'), ('r', '\r'), ('b', '\b'), ('f', '\f'),
+                        ('\\', '\\'), ('"', '"'), ("'", "'")):
+    _ESCAPE_TBL[ord(_char)] = _decoded
+
+# kind of token an ASCII char starts, indexed by ord(), other chars start
+# identifiers
+_IDENTIFIER = 0
+_NEWLINE = 1
+_PARENTHESIS_L = 2
+_PARENTHESIS_R = 3
+_COLON = 4
+_DIGIT = 5
+_QUOTE = 6
+_OPERATOR = 7
+_CHAR_CLASS = bytearray(128)
+_CHAR_CLASS[ord('\n')] = _NEWLINE
+for _char in '([{':
+    _CHAR_CLASS[ord(_char)] = _PARENTHESIS_L
+for _char in ')]}':
+    _CHAR_CLASS[ord(_char)] = _PARENTHESIS_R
+_CHAR_CLASS[ord(':')] = _COLON
+for _char in '0123456789':
+    _CHAR_CLASS[ord(_char)] = _DIGIT
+for _char in '\'"':
+    _CHAR_CLASS[ord(_char)] = _QUOTE
+for _char in OPERATOR_SYMBOLS:
+    _CHAR_CLASS[ord(_char)] = _OPERATOR
+del _char, _decoded
+
+
 class TokenType(Enum):
     LITERAL = 1
     IDENTIFIER = 2
@@ -31,175 +83,146 @@ class Lexer:
     def __init__(self):
         self.source = ""
         self.pos = 0
-        self.current_char = None
+        # the compiled lexer, if the extension has been built
+        self._compiled = CyLexer(Token, TokenType, LexerError) if CyLexer is not None else None
 
     def error(self, message):
         raise LexerError(f'Token error: {message}')
 
-    def advance(self):
-        self.pos += 1
-        if self.pos >= len(self.source):
-            self.current_char = None
-        else:
-            self.current_char = self.source[self.pos]
-
     def next_token(self):
+        source = self.source
         # skip spaces
-        while self.current_char == ' ':
-            self.advance()
+        pos = self.pos = _SPACES_RE.match(source, self.pos).end()
+        if pos >= len(source):
+            return None
+        char = source[pos]
+        code = ord(char)
+        kind = _CHAR_CLASS[code] if code < 128 else _IDENTIFIER
 
-        if self.current_char == '\n':
-            token = Token(TokenType.NEWLINE, self.current_char)
-            self.advance()
-            return token
+        if kind == _IDENTIFIER:
+            return self._get_identifier_token()
 
-        if self.current_char in "([{":
-            token = Token(TokenType.PARENTHESIS_L, self.current_char)
-            self.advance()
-            return token
+        if kind == _DIGIT:
+            return self._get_number_token()
 
-        if self.current_char in ")]}":
-            token = Token(TokenType.PARENTHESIS_R, self.current_char)
-            self.advance()
-            return token
+        if kind == _OPERATOR:
+            self.pos += 1
+            return Token(TokenType.IDENTIFIER, char)
 
-        if self.current_char == ':':
-            return self._get_assignment_token()
-        
-        if self.current_char.isdigit():
-            return self._get_number_token()
+        if kind == _NEWLINE:
+            self.pos += 1
+            return Token(TokenType.NEWLINE, char)
 
-        if self.current_char in "\'\"":
-            return self._get_string_token()
+        if kind == _PARENTHESIS_L:
+            self.pos += 1
+            return Token(TokenType.PARENTHESIS_L, char)
 
-        return self._get_identifier_token()
+        if kind == _PARENTHESIS_R:
+            self.pos += 1
+            return Token(TokenType.PARENTHESIS_R, char)
+
+        if kind == _COLON:
+            return self._get_assignment_token()
+
+        return self._get_string_token()
 
     def parse(self, source):
+        if self._compiled is not None:
+            return self._compiled.parse(source.encode('utf-8', 'surrogatepass'))
         self.source = source
         self.pos = 0
-        self.current_char = self.source[self.pos]
-        tokens = []
-        while self.current_char:
-            tokens.append(self.next_token())
-        return tokens
+        # next_token returns None at the end of the source, list() collects
+        # the tokens in C rather than through a loop of appends
+        return list(iter(self.next_token, None))
 
     def consume(self, char):
-        if self.current_char == char:
-            self.advance()
+        if self.source.startswith(char, self.pos):
+            self.pos += len(char)
             return
-        else:
-            if self.current_char is None:
-                self.error(f'Unexpected EOF')
-            self.error(f'Unexpected character "{self.current_char}"')
+        if self.pos >= len(self.source):
+            self.error(f'Unexpected EOF')
+        self.error(f'Unexpected character "{self.source[self.pos]}"')
 
     def _get_number_token(self):
-        res = ""
-        while self.current_char and self.current_char.isdigit():
-            res += self.current_char
-            self.advance()
-
-        if self.current_char != '.':
-            return Token(TokenType.LITERAL, int(res))
-
-        res += self.current_char
-        self.advance()
-
-        while self.current_char and self.current_char.isdigit():
-            res += self.current_char
-            self.advance()
-
-        return Token(TokenType.LITERAL, float(res))
+        match = _NUMBER_RE.match(self.source, self.pos)
+        self.pos = match.end()
+        if match.group(1) is None:
+            return Token(TokenType.LITERAL, int(match.group()))
+        return Token(TokenType.LITERAL, float(match.group()))
 
     def _get_string_token(self):
-        res = ""
-        quot = self.current_char  # 记录引号类型（单引号或双引号）
-        self.advance()
-
-        while self.current_char and self.current_char != quot:
-            if self.current_char == '\n':
+        source = self.source
+        quot = source[self.pos]  # 记录引号类型（单引号或双引号）
+        self.pos += 1
+        run = _STRING_RUN_RE[quot]
+
+        # 没有转义字符的部分整段切片，只有转义字符才单独处理
+        parts = []
+        while True:
+            end = run.match(source, self.pos).end()
+            parts.append(source[self.pos:end])
+            self.pos = end
+            if end >= len(source) or source[end] == quot:
+                break
+            if source[end] == '\n':
                 self.error("Unexpected End of Line")
 
             # 处理转义字符
-            if self.current_char == '\\':
-                self.advance()  # 跳过反斜杠
-                if not self.current_char:
-                    break  # EOF检查
-
-                # 处理常见转义序列
-                escape_map = {
-                    'n': '\n',
-                    't': '\t',
-                    'r': '\r',
-                    'b': '\b',
-                    'f': '\f',
-                    '\\': '\\',
-                    '"': '"',
-                    "'": "'",
-                    # 可以添加更多转义序列
-                }
-
-                if self.current_char in escape_map:
-                    res += escape_map[self.current_char]
-                    self.advance()
-                elif self.current_char == 'x':
-                    # 处理十六进制转义：\xHH
-                    self.advance()
-                    hex_digits = self._read_hex_digits(2)
-                    res += chr(int(hex_digits, 16))
-                elif self.current_char == 'u':
-                    # 处理Unicode转义：\uHHHH
-                    self.advance()
-                    hex_digits = self._read_hex_digits(4)
-                    res += chr(int(hex_digits, 16))
-                elif self.current_char == 'U':
-                    # 处理长Unicode转义：\UHHHHHHHH
-                    self.advance()
-                    hex_digits = self._read_hex_digits(8)
-                    res += chr(int(hex_digits, 16))
-                else:
-                    # 未知转义字符，保持原样（包括反斜杠）
-                    res += '\\' + self.current_char
-                    self.advance()
+            self.pos += 1  # 跳过反斜杠
+            if self.pos >= len(source):
+                break  # EOF检查
+            char = source[self.pos]
+
+            # 处理常见转义序列
+            code = ord(char)
+            decoded = _ESCAPE_TBL[code] if code < 128 else None
+            if decoded is not None:
+                parts.append(decoded)
+                self.pos += 1
+            elif char == 'x':
+                # 处理十六进制转义：\xHH
+                self.pos += 1
+                hex_digits = self._read_hex_digits(2)
+                parts.append(chr(int(hex_digits, 16)))
+            elif char == 'u':
+                # 处理Unicode转义：\uHHHH
+                self.pos += 1
+                hex_digits = self._read_hex_digits(4)
+                parts.append(chr(int(hex_digits, 16)))
+            elif char == 'U':
+                # 处理长Unicode转义：\UHHHHHHHH
+                self.pos += 1
+                hex_digits = self._read_hex_digits(8)
+                parts.append(chr(int(hex_digits, 16)))
             else:
-                res += self.current_char
-                self.advance()
+                # 未知转义字符，保持原样（包括反斜杠）
+                parts.append('\\' + char)
+                self.pos += 1
 
         # 消费结束引号
         self.consume(quot)
-        return Token(TokenType.LITERAL, res)
+        return Token(TokenType.LITERAL, ''.join(parts))
 
     def _get_identifier_token(self):
-        if self.current_char in OPERATOR_SYMBOLS:
-            token = Token(TokenType.IDENTIFIER, self.current_char)
-            self.advance()
-            return token
-
-        res = ""
-        while (self.current_char and
-               self.current_char not in NON_IDENTIFIER_SYMBOLS and
-               self.current_char not in OPERATOR_SYMBOLS):
-            res += self.current_char
-            self.advance()
-        return Token(TokenType.IDENTIFIER, res)
+        match = _IDENTIFIER_RE.match(self.source, self.pos)
+        self.pos = match.end()
+        return Token(TokenType.IDENTIFIER, sys.intern(match.group()))
 
     def _read_hex_digits(self, count):
         """读取指定数量的十六进制数字"""
-        digits = ""
-        for _ in range(count):
-            if self.current_char and self.current_char.upper() in "0123456789ABCDEF":
-                digits += self.current_char
-                self.advance()
-            else:
-                self.error(f"Expected {count} hex digits after escape sequence")
-        return digits
+        start = self.pos
+        end = _HEX_DIGITS_RE.match(self.source, start, start + count).end()
+        if end - start != count:
+            self.error(f"Expected {count} hex digits after escape sequence")
+        self.pos = end
+        return self.source[start:end]
 
     def _get_assignment_token(self):
-        self.consume(':')
-        try:
-            self.consume('=')
+        if self.source.startswith(':=', self.pos):
+            self.pos += 2
             return Token(TokenType.ASSIGNMENT, ':=')
-        except LexerError:
-            return Token(TokenType.IDENTIFIER, ':')
+        self.pos += 1
+        return Token(TokenType.IDENTIFIER, ':')
 
 
 if __name__ == '__main__':
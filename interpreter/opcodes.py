@@ -0,0 +1,143 @@
+# opcodes.py
+"""
+opcodes of the compiled form of an Expr
+
+every instruction is an (opcode, arg) pair, the opcodes are small ints so
+the runtime can dispatch them through a tuple
+"""
+import operator
+
+# calls, handled by the loop in RunTime.execute itself
+CALL_USER = 0       # arg: the Expr of the word, compiled when called
+TAILCALL = 1        # arg: the Expr of the word, compiled when called
+CALL_QUOT = 2       # arg: the `\` builtin function
+LAST_CONTROL = CALL_QUOT
+
+PUSH_LITERAL = 3    # arg: the literal value
+PUSH_QUOT = 4       # arg: the Quot node
+BEGIN_LIST = 5      # arg: None, the items of the list follow inline
+END_LIST = 6        # arg: None
+CALL_BUILTIN = 7    # arg: the builtin function
+UNKNOWN = 8         # arg: the unresolved name
+CHECK_DEPTH = 9     # arg: (depth needed, the block without inlined builtins)
+
+# builtins inlined by the compiler, arg: the builtin function
+ADD = 10
+SUB = 11
+MUL = 12
+DIV = 13
+MOD = 14
+DUP = 15
+DROP = 16
+SWAP = 17
+ROT = 18
+
+INLINE_OPS = frozenset((ADD, SUB, MUL, DIV, MOD, DUP, DROP, SWAP, ROT))
+
+# (items read, items left) of the instructions that only touch the stack
+STACK_EFFECTS = {
+    PUSH_LITERAL: (0, 1),
+    PUSH_QUOT: (0, 1),
+    ADD: (2, 1),
+    SUB: (2, 1),
+    MUL: (2, 1),
+    DIV: (2, 1),
+    MOD: (2, 1),
+    DUP: (1, 2),
+    DROP: (1, 0),
+    SWAP: (2, 2),
+    ROT: (3, 3),
+}
+
+# arithmetic the compiler can do ahead of time on number literals
+ARITHMETIC = {
+    ADD: operator.add,
+    SUB: operator.sub,
+    MUL: operator.mul,
+    DIV: operator.truediv,
+    MOD: operator.mod,
+}
+NUMBER_TYPES = (int, float)
+
+
+def fold_constants(code):
+    """
+    Forward pass over code that runs the stack ops whose operands are
+    literals at compile time. Arithmetic is only folded when both operands
+    are ints or floats and the result doesn't raise
+    """
+    result = []
+    known = 0  # how many of the last instructions in result are literal pushes
+    for op, arg in code:
+        if op == PUSH_LITERAL:
+            result.append((op, arg))
+            known += 1
+            continue
+        if op in ARITHMETIC and known >= 2:
+            a = result[-2][1]
+            b = result[-1][1]
+            if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                try:
+                    value = ARITHMETIC[op](a, b)
+                except ArithmeticError:
+                    pass
+                else:
+                    result[-2:] = [(PUSH_LITERAL, value)]
+                    known -= 1
+                    continue
+        elif op == DUP and known >= 1:
+            result.append(result[-1])
+            known += 1
+            continue
+        elif op == DROP and known >= 1:
+            del result[-1]
+            known -= 1
+            continue
+        elif op == SWAP and known >= 2:
+            result[-2], result[-1] = result[-1], result[-2]
+            continue
+        elif op == ROT and known >= 3:
+            result.append(result.pop(-3))
+            continue
+        result.append((op, arg))
+        known = 0
+    return result
+
+
+def hoist_depth_checks(code):
+    """
+    Split code into blocks of stack-only instructions and guard each block
+    with one CHECK_DEPTH instead of checking the depth in every builtin
+    """
+    result = []
+    start = 0
+    need = depth = 0
+    for op, arg in code:
+        effect = STACK_EFFECTS.get(op)
+        if effect is None:
+            _guard_block(result, start, need)
+            result.append((op, arg))
+            start = len(result)
+            need = depth = 0
+            continue
+        read, left = effect
+        need = max(need, read - depth)
+        depth += left - read
+        result.append((op, arg))
+    _guard_block(result, start, need)
+    return result
+
+
+def mark_tail_call(code):
+    """Turn a call in tail position into a TAILCALL"""
+    if code and code[-1][0] == CALL_USER:
+        code[-1] = (TAILCALL, code[-1][1])
+    return code
+
+
+def _guard_block(code, start, need):
+    if need <= 0:
+        return
+    block = tuple((CALL_BUILTIN, arg) if op in INLINE_OPS else (op, arg)
+                  for op, arg in code[start:])
+    code.insert(start, (CHECK_DEPTH, (need, block)))
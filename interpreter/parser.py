@@ -13,17 +13,34 @@ quot ::= '[' expr ']'
 list ::= '{' expr '}'
 """
 from interpreter.lexer import TokenType
+from interpreter.opcodes import (PUSH_LITERAL, PUSH_QUOT, BEGIN_LIST, END_LIST,
+                                 fold_constants, hoist_depth_checks, mark_tail_call)
+
+
+_PAREN_PAIRS = {'(': ')', '[': ']', '{': '}'}
+# token types that end an expr
+_EXPR_STOP = frozenset((TokenType.NEWLINE, TokenType.PARENTHESIS_R))
+
+# token types read on the hot path, saves the attribute lookup on the Enum
+_TT_LITERAL = TokenType.LITERAL
+_TT_IDENTIFIER = TokenType.IDENTIFIER
+_TT_PARENTHESIS_L = TokenType.PARENTHESIS_L
 
 
 class ASTNode:
+    __slots__ = ()
+    # name of the visitor method, set by every subclass
+    _visit_name = 'generic_visit'
+
     def accept(self, visitor):
-        method_name = f'visit_{self.__class__.__name__.lower()}'
-        # print(f'Visiting {method_name}')
-        visit_method = getattr(visitor, method_name, visitor.generic_visit)
+        visit_method = getattr(visitor, self._visit_name, visitor.generic_visit)
         return visit_method(self)
 
 
 class Program(ASTNode):
+    __slots__ = ('statements',)
+    _visit_name = 'visit_program'
+
     def __init__(self):
         self.statements = []
 
@@ -35,17 +52,58 @@ class Program(ASTNode):
 
 
 class Expr(ASTNode):
+    __slots__ = ('atoms', 'code', 'code_owner', 'code_version')
+    _visit_name = 'visit_expr'
+
     def __init__(self):
         self.atoms = []
+        # compiled form, only valid for `code_owner` at `code_version`
+        self.code = None
+        self.code_owner = None
+        self.code_version = -1
 
     def add_atom(self, atom):
         self.atoms.append(atom)
 
+    def compile(self, runtime):
+        """Compile the atoms into a flat list of (opcode, arg) pairs,
+        identifiers are resolved once against the scopes of runtime"""
+        code = []
+        _compile_atoms(self.atoms, runtime, code)
+        code = mark_tail_call(hoist_depth_checks(fold_constants(code)))
+        # only cached once the whole body compiled, a compile that raises
+        # leaves the expr stale
+        self.code = code
+        self.code_owner = runtime
+        self.code_version = runtime.scope_version
+        return code
+
     def __repr__(self):
         return f'Expr({self.atoms})'
 
 
+def _compile_atoms(atoms, runtime, code):
+    # the node classes are never subclassed, so an identity check on the
+    # type is enough and cheaper than isinstance
+    for atom in atoms:
+        kind = type(atom)
+        if kind is Literal:
+            code.append((PUSH_LITERAL, atom.content))
+        elif kind is Identifier:
+            code.append(runtime.resolve(atom.name))
+        elif kind is Quot:
+            code.append((PUSH_QUOT, atom))
+        elif kind is List:
+            # the items run on the same stack, above a savepoint
+            code.append((BEGIN_LIST, None))
+            _compile_atoms(atom.items.atoms, runtime, code)
+            code.append((END_LIST, None))
+
+
 class Decl(ASTNode):
+    __slots__ = ('word', 'expr')
+    _visit_name = 'visit_decl'
+
     def __init__(self, word, expr):
         self.word = word
         self.expr = expr
@@ -55,6 +113,9 @@ class Decl(ASTNode):
 
 
 class Literal(ASTNode):
+    __slots__ = ('content',)
+    _visit_name = 'visit_literal'
+
     def __init__(self, content):
         self.content = content
 
@@ -63,6 +124,9 @@ class Literal(ASTNode):
 
 
 class Identifier(ASTNode):
+    __slots__ = ('name',)
+    _visit_name = 'visit_identifier'
+
     def __init__(self, name):
         self.name = name
 
@@ -71,6 +135,9 @@ class Identifier(ASTNode):
 
 
 class List(ASTNode):
+    __slots__ = ('items',)
+    _visit_name = 'visit_list'
+
     def __init__(self, items):
         self.items = items
 
@@ -79,6 +146,9 @@ class List(ASTNode):
 
 
 class Quot(ASTNode):
+    __slots__ = ('expr',)
+    _visit_name = 'visit_quot'
+
     def __init__(self, expr):
         self.expr = expr
 
@@ -92,8 +162,7 @@ class ParserError(Exception):
 
 
 def is_match(left, right):
-    table = {'(': ')', '[': ']', '{': '}'}
-    return table.get(left, 0) == right
+    return _PAREN_PAIRS.get(left) == right
 
 
 class Parser:
@@ -158,24 +227,30 @@ class Parser:
 
     def _parse_expression(self):
         expr = Expr()
-        while not self.eof() and self.peek().type != TokenType.NEWLINE and self.peek().type != TokenType.PARENTHESIS_R:
-            atom = self._parse_atom()
-            expr.add_atom(atom)
+        atoms = expr.atoms
+        append = atoms.append
+        parse_atom = self._parse_atom
+        tokens = self.tokens
+        end = len(tokens)
+        while self.index < end and tokens[self.index].type not in _EXPR_STOP:
+            append(parse_atom())
         return expr
 
     def _parse_atom(self):
-        current = self.peek()
-        if current.type == TokenType.LITERAL:
-            self.consume(TokenType.LITERAL)
+        # only called by _parse_expression, which checked the index
+        current = self.tokens[self.index]
+        _type = current.type
+        if _type is _TT_LITERAL:
+            self.index += 1
             return Literal(current.value)
 
-        if current.type == TokenType.IDENTIFIER:
-            self.consume(TokenType.IDENTIFIER)
+        if _type is _TT_IDENTIFIER:
+            self.index += 1
             return Identifier(current.value)
 
-        if current.type == TokenType.PARENTHESIS_L:
+        if _type is _TT_PARENTHESIS_L:
             left = current.value
-            self.consume(TokenType.PARENTHESIS_L)
+            self.index += 1
             expr = self._parse_expression()
             right = self.consume(TokenType.PARENTHESIS_R).value
             if not is_match(left, right):
@@ -0,0 +1,15 @@
+# setup.py
+"""
+builds the optional compiled lexer:
+
+    python setup.py build_ext --inplace
+
+without it the pure Python lexer is used
+"""
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+setup(
+    name='mini-lang',
+    ext_modules=cythonize(Extension('interpreter._cylexer', ['interpreter/_cylexer.pyx'])),
+)